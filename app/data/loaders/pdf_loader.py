@@ -6,7 +6,7 @@
             {
                 "title": str,
                 "text": str,
-                "pages": [{"page": int, "chars": int}, ...],
+                "pages": [{"page": int, "chars": int, "start": int, "end": int}, ...],
                 "meta": {"author": str|None, "subject": str|None}
                 "ocr_needed_pages": [int, ...],
             
@@ -15,25 +15,49 @@
     Заметки:
         - Никаких агрессивных чисток здесь не делаем
         - Если страница без текста (скан), попадает в ocr_needed_pages
+        - start/end - смещения текста страницы в "text" (страницы разделены "\n")
+        - Большие документы разбираются в нескольких процессах по диапазонам страниц:
+          PyMuPDF не поддерживает работу с одним документом из нескольких потоков.
+          Процессы запускаются методом "spawn" (fork процесса, где уже работают потоки
+          torch/sentence-transformers, может зависнуть), поэтому вызывающий скрипт
+          должен запускать код под защитой if __name__ == "__main__":
 """
 
 from __future__ import annotations
-from typing import Dict, Any, List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Iterator, List
 
+import io
+import multiprocessing
+import os
 import pathlib
 import fitz
+import numpy as np
+
+# С какого числа страниц имеет смысл поднимать пул процессов
+_PARALLEL_MIN_PAGES = 64
+
+# Рабочие процессы - через spawn, а не fork по умолчанию: fork многопоточного процесса небезопасен
+_MP_CONTEXT = multiprocessing.get_context("spawn")
+
+# Флаги "text" по умолчанию + склейка переносов слов на стороне PyMuPDF
+_TEXT_FLAGS = fitz.TEXTFLAGS_TEXT | fitz.TEXT_DEHYPHENATE
 
 # Пытаемся получить максимально пригодный текст.
 def _page_text(page: "fitz.Page") -> str:
-    txt = page.get_text("text") or ""
+    txt = page.get_text("text", flags=_TEXT_FLAGS) or ""
     if txt.strip():
-        return txt.replase("\r\n", "\n").replace("\r", "\n")
+        return txt.replace("\r\n", "\n").replace("\r", "\n")
 
-    # fallback: blocks -> строки по порядку
+    # fallback (страница без текстового слоя): blocks -> строки по порядку
     blocks = page.get_text("blocks") or []
 
     # blocks: [(x0, y0, x1, y1, "text", block_no, block_type, ...)]
-    blocks = sorted(blocks, key=lambda b: (round(b[1], 2), round(b[0], 2)))
+    # Порядок чтения: сверху вниз, затем слева направо - сортировка в NumPy, без Python-ключа
+    if len(blocks) > 1:
+        ys = np.fromiter((round(b[1], 2) for b in blocks), dtype=np.float64, count=len(blocks))
+        xs = np.fromiter((round(b[0], 2) for b in blocks), dtype=np.float64, count=len(blocks))
+        blocks = [blocks[i] for i in np.lexsort((xs, ys))]
     lines: List[str] = []
     for b in blocks:
         t = (b[4] or "").strip()
@@ -41,24 +65,49 @@ def _page_text(page: "fitz.Page") -> str:
             lines.append(t)
     return ("\n".join(lines)).replace("\r\n", "\n").replace("\r", "\n")
 
+# Текст страниц [start, stop) - выполняется в отдельном процессе со своим экземпляром документа
+def _range_texts(path: str, start: int, stop: int) -> List[str]:
+    with fitz.open(path) as pdf:
+        return [_page_text(pdf.load_page(i)) for i in range(start, stop)]
+
+# Тексты страниц по порядку. Небольшие документы - последовательно в текущем процессе
+def _iter_page_texts(pdf: "fitz.Document", path: str) -> Iterator[str]:
+    n = pdf.page_count
+    workers = min(os.cpu_count() or 1, n // _PARALLEL_MIN_PAGES)
+    if workers < 2:
+        for i in range(n):
+            yield _page_text(pdf.load_page(i))
+        return
+
+    step = -(-n // workers)
+    starts = list(range(0, n, step))
+    stops = [min(s + step, n) for s in starts]
+    with ProcessPoolExecutor(max_workers=len(starts), mp_context=_MP_CONTEXT) as ex:
+        for texts in ex.map(_range_texts, [path] * len(starts), starts, stops):
+            yield from texts
+
 def extract_pdf(path: str) -> Dict[str, Any]:
     pdf = fitz.open(path)
     meta = pdf.metadata or {}
     title = meta.get("title") or pathlib.Path(path).stem
 
-    all_text_parts: List[str] = []
+    # Текст страниц пишем потоково, без списка частей и последующего join
+    buf = io.StringIO()
+    pos = 0
     pages_meta: List[Dict[str, int]] = []
     ocr_needed: List[int] = []
 
-    for i in range(pdf.page_count):
-        page = pdf.load_page(i)
-        text = _page_text(page)
+    for i, text in enumerate(_iter_page_texts(pdf, path)):
         if not text.strip():
             ocr_needed.append(i + 1)
-        all_text_parts.append(text)
-        pages_meta.append({"page": i + 1, "chars": len(text)})
+        if i:
+            buf.write("\n")
+            pos += 1
+        buf.write(text)
+        pages_meta.append({"page": i + 1, "chars": len(text), "start": pos, "end": pos + len(text)})
+        pos += len(text)
 
-    text_full = "\n".join(all_text_parts)
+    text_full = buf.getvalue()
 
     return {
         "title": title.strip(),
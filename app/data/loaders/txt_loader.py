@@ -19,6 +19,10 @@ import re
 
 _DEF_CODECS: tuple[str, ...] = ("utf-8", "utf-8-sig", "cp1251", "koi8-r", "latin1")
 
+# Таблица для str.translate: управляющие символы < 32 удаляем (кроме \t и \n), одиночный \r -> \n
+_CTRL_TABLE: dict[int, int | None] = {i: None for i in range(32) if i not in (0x09, 0x0A)}
+_CTRL_TABLE[0x0D] = 0x0A
+
 def _read_text_any(path: str | pathlib.Path, encodings: Iterable[str] = _DEF_CODECS) -> str:
     last_err: Exception | None = None
     for enc in encodings:
@@ -38,55 +42,66 @@ def _read_text_any(path: str | pathlib.Path, encodings: Iterable[str] = _DEF_COD
 # ===========================================================================================
 
 _RE_YAML_FRONT = re.compile(r"(?s)^\s*---\s*\n.*?\n---\s*\n")
-_RE_CODE_FENCE = re.compile(r"(?m)^```.*?$[\s\S]*?^```$")  # блоки ```...```
-_RE_INLINE_CODE = re.compile(r"`([^`]+)`")
-_RE_IMAGE = re.compile(r"!\[[^\]]*\]\([^)]+\)")           # ![alt](url)
-_RE_LINK = re.compile(r"\[([^\]]+)\]\([^)]+\)")           # [text](url) -> text
-_RE_BOLD = re.compile(r"(\*\*|__)(.*?)\1")
-_RE_ITAL = re.compile(r"(\*|_)(.*?)\1")
-_RE_HTML_TAG = re.compile(r"</?[^>]+>")
-_RE_MD_HEAD = re.compile(r"(?m)^\s{0,3}#{1,6}\s*")
-_RE_MD_LIST = re.compile(r"(?m)^\s{0,3}([-*+]|(\d+)[.)])\s+")
+
+# Инлайн-разметка: код, изображения, ссылки, жирный/курсив, HTML-теги
+_MD_INLINE = (
+    r"(?P<code>`(?P<code_body>[^`]+)`)"                                  # `code` -> code
+    r"|(?P<img>!\[[^\]]*\]\([^)]+\))"                                    # ![alt](url) -> ""
+    r"|(?P<link>\[(?P<link_text>[^\]]+)\]\([^)]+\))"                      # [text](url) -> text
+    r"|(?P<bold>(?P<bold_mark>\*\*|__)(?P<bold_body>.*?)(?P=bold_mark))"
+    r"|(?P<ital>(?P<ital_mark>[*_])(?P<ital_body>.*?)(?P=ital_mark))"
+    r"|(?P<html></?[^>]+>)"
+)
+
+# Вся разметка одним проходом: блоки ```...```, заголовки '#', маркеры списков + инлайн
+_RE_MD = re.compile(
+    r"(?P<fence>^```[\s\S]*?^```[ \t]*$)"
+    r"|(?P<head>^\s{0,3}#{1,6}\s*)"
+    r"|(?P<list>^\s{0,3}(?:[-*+]|\d+[.)])\s+)"
+    r"|" + _MD_INLINE,
+    re.MULTILINE,
+)
+_RE_MD_INLINE = re.compile(_MD_INLINE)
+
+# Группа с "полезным" текстом для элементов, от которых оставляем содержимое
+_MD_INNER = {"link": "link_text", "bold": "bold_body", "ital": "ital_body"}
+
+# Замена для найденного элемента разметки (по имени сработавшей группы)
+def _md_repl(m: re.Match) -> str:
+    kind = m.lastgroup
+    if kind == "code":
+        return m.group("code_body")
+    inner = _MD_INNER.get(kind)
+    if inner is not None:
+
+        # Внутри текста ссылки/выделения может быть вложенная инлайн-разметка
+        return _RE_MD_INLINE.sub(_md_repl, m.group(inner))
+    if kind == "list":
+        return "- "
+
+    # fence, img, html, head - удаляем целиком
+    return ""
 
 
 def _simplify_markdown(text: str) -> str:
 
     # Удалить YAML front matter
     text = _RE_YAML_FRONT.sub("", text)
-    
-    # Удалить блоки кода и инлайн-код - оставим только соержимое инлайн-кода
-    text = _RE_CODE_FENCE.sub("", text)
-    text = _RE_INLINE_CODE.sub(r"\1", text)
-
-    # Изображения полностью убрать, ссылки - оставить текста
-    text = _RE_IMAGE.sub("", text)
-    text = _RE_LINK.sub("", text)
-
-    # Форматирование Жирный/Курсив снять
-    text = _RE_BOLD.sub(r"\2", text)
-    text = _RE_ITAL.sub(r"\2", text)
 
-    # HTML-теги удалить
-    text = _RE_HTML_TAG.sub("", text)
-
-    # Заголовки '#' убрать, маркеры списков заменить на тире
-    text = _RE_MD_HEAD.sub("", text)
-    text = _RE_MD_LIST.sub("- ", text)
-
-    return text
+    # Блоки кода и изображения убрать, от инлайн-кода и ссылок оставить текст,
+    # снять жирный/курсив и HTML-теги, заголовки '#' убрать, маркеры списков заменить на тире
+    return _RE_MD.sub(_md_repl, text)
 
 def extract_text_file(path: str) -> str:
     p = pathlib.Path(path)
     raw = _read_text_any(p)
 
-    # Нормализуем переносы строк
-    raw = raw.replace("\r\n", "\n").replace("\r", "\n")
+    # Нормализуем переносы строк и уберем скрытые нулевые символы/непечатные суррогаты,
+    # не трогая \n и \t: одиночные \r переводятся в \n той же таблицей
+    raw = raw.replace("\r\n", "\n").translate(_CTRL_TABLE)
 
     if p.suffix.lower() == ".md":
         raw = _simplify_markdown(raw)
 
-    # Уберем скрытые нулевые символы/непечатные суррогаты, но не трогаем \n и \t
-    raw = "".join(ch for ch in raw if ch =="\n" or ch == "\t" or (ord(ch) >= 32))
-
     # Трим по краям - глубокая очистка дальше в normalizer.clean()
     return raw.strip()
\ No newline at end of file
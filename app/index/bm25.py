@@ -1,9 +1,10 @@
 """
-    Лексический переранкер BM25 на основе rank_bm25.
+    Лексический переранкер BM25 на основе bm25s (скоринг через numba JIT, если доступна).
 
     Публичный API:
         - bm25_rerank(query: str, passages: list[dict], *, top_k=5,
                   alpha=0.6, beta=0.4, tokenize: Callable[[str], list[str]] | None = None) -> list[dict]
+        - build_bm25_index(passages: list[dict], *, tokenize=None) -> bm25s.BM25
 
     Где:
         - passages — элементы с ключом "text" и (опц.) "score" от векторного поиска.
@@ -14,28 +15,127 @@
     Замечания:
         - Нормализация: min-max для обоих компонентов по текущей выборке.
         - Токенизация упрощённая: по словам (латиница/кириллица/цифры), нижний регистр.
+          Если установлен сторонний модуль regex, шаблон компилируется им, иначе - стандартным re.
+        - При токенизаторе по умолчанию токены и индекс кэшируются между вызовами,
+          поэтому повторный rerank того же пула пассажей не строит индекс заново.
 """
 
 from __future__ import annotations
-from typing import Callable, List, Dict, Any
-from rank_bm25 import BM25Okapi
+from collections import OrderedDict
+from typing import Callable, List, Dict, Any, Tuple
 
+import functools
+import hashlib
 import math
 import re
+import threading
 
-_WORD_RE = re.compile(r"[A-Za-zА-Яа-яЁё0-9_]+")
+import bm25s
+import numpy as np
 
+try:
+    import regex as _re
+except Exception:
+    _re = None
+
+try:
+    import xxhash
+except Exception:
+    xxhash = None
+
+# Компилируется один раз при импорте, в кэш re._cache не попадает
+if _re is not None:
+    _WORD_RE = _re.compile(r"[A-Za-zА-Яа-яЁё0-9_]+", _re.V1)
+else:
+    _WORD_RE = re.compile(r"[A-Za-zА-Яа-яЁё0-9_]+")
+
+# Один lower() на весь текст и findall без групп: список строк собирается в C, без Match-объектов
 def _default_tokenize(text: str) -> List[str]:
-    return [m.group(0).lower() for m in _WORD_RE.finditer(text or "")]
+    return _WORD_RE.findall((text or "").lower())
+
+# Кэш токенов по тексту пассажа (tuple - чтобы результат был неизменяемым)
+@functools.lru_cache(maxsize=8192)
+def _tok_cached(text: str) -> Tuple[str, ...]:
+    return tuple(_default_tokenize(text))
+
+# Скомпилированный numba-скорер: компилируется один раз на процесс и переиспользуется всеми индексами
+_NUMBA_SCORER = None
+
+# get_scores считает релевантность через _compute_relevance_from_scores: по умолчанию это NumPy-версия,
+# backend влияет только на retrieve(). activate_numba_scorer подменяет ее на njit-версию, но каждый
+# вызов создает новую функцию и компилирует ее заново, поэтому активируем только у первого индекса
+def _activate_numba(bm: bm25s.BM25) -> None:
+    global _NUMBA_SCORER
+    if bm.backend != "numba":
+        return
+    if _NUMBA_SCORER is None:
+        bm.activate_numba_scorer()
+        _NUMBA_SCORER = bm._compute_relevance_from_scores
+    else:
+        bm._compute_relevance_from_scores = _NUMBA_SCORER
+
+def _new_bm25(docs_tokens: List[List[str]]) -> bm25s.BM25:
+
+    # bm25s строит разреженную матрицу term-doc один раз и считает релевантность
+    # векторно; backend="auto" - "numba", если она установлена, тогда скоринг идет через JIT
+    bm = bm25s.BM25(method="lucene", backend="auto")
+    bm.index(docs_tokens, show_progress=False)
+    _activate_numba(bm)
+    return bm
+
+# Отпечаток набора текстов (8 байт): xxh64, если установлен xxhash, иначе blake2b.
+# Число текстов и длина каждого входят в хэш: одного разделителя мало -
+# ("a\x1fb",) и ("a", "b") иначе дали бы один ключ
+def _fingerprint(texts: Tuple[str, ...]) -> bytes:
+    h = xxhash.xxh64() if xxhash is not None else hashlib.blake2b(digest_size=8)
+    h.update(len(texts).to_bytes(8, "little"))
+    for t in texts:
+        b = t.encode("utf-8")
+        h.update(len(b).to_bytes(8, "little"))
+        h.update(b)
+    return h.digest()
+
+# LRU-кэш индексов по отпечатку: ключ - 8 байт, тексты этим кэшем не удерживаются
+# (но сами тексты пассажей остаются ключами _tok_cached, до 8192 штук).
+# rerank вызывается из обработчиков запросов параллельно, поэтому чтение/вставка/вытеснение -
+# под блокировкой; индекс строится вне ее, при гонке побеждает последний построенный
+_BM_CACHE_SIZE = 64
+_BM_CACHE: "OrderedDict[bytes, bm25s.BM25]" = OrderedDict()
+_BM_CACHE_LOCK = threading.Lock()
 
-def _minmax(xs: List[fload]) -> List[float]:
-    if not xs:
+def _build_bm(texts: Tuple[str, ...]) -> bm25s.BM25:
+    key = _fingerprint(texts)
+    with _BM_CACHE_LOCK:
+        bm = _BM_CACHE.get(key)
+        if bm is not None:
+            _BM_CACHE.move_to_end(key)
+            return bm
+    bm = _new_bm25([list(_tok_cached(t)) for t in texts])
+    with _BM_CACHE_LOCK:
+        _BM_CACHE[key] = bm
+        _BM_CACHE.move_to_end(key)
+        if len(_BM_CACHE) > _BM_CACHE_SIZE:
+            _BM_CACHE.popitem(last=False)
+    return bm
+
+def _minmax(xs: np.ndarray) -> np.ndarray:
+    if xs.size == 0:
         return xs
-    lo, hi = min(xs), max(xs)
+    lo, hi = float(xs.min()), float(xs.max())
     if math.isclose(hi, lo):
-        return [0.0 for _ in xs]
-    scale = hi - lo
-    return [(x - lo) / scale for x in xs] 
+        return np.zeros_like(xs)
+    return (xs - lo) / (hi - lo)
+
+# BM25-индекс по пассажам. С токенизатором по умолчанию результат кэшируется
+def build_bm25_index(
+    passages: List[Dict[str, Any]],
+    *,
+    tokenize: Callable[[str], List[str]] | None = None,
+) -> bm25s.BM25:
+    texts = tuple(p.get("text", "") or "" for p in passages)
+    if tokenize is None:
+        return _build_bm(texts)
+    return _new_bm25([tokenize(t) for t in texts])
 
 def bm25_rerank(
     query: str,
@@ -50,24 +150,24 @@ def bm25_rerank(
         return passages
 
     tok = tokenize or _default_tokenize
+    bm = build_bm25_index(passages, tokenize=tokenize)
 
-    docs_tokens = [tok(p.get("text", "")) for p in passages]
-    bm = BM25Okapi(docs_tokens)
-
+    # Пустой запрос (или только знаки препинания): bm25s.get_scores читает q_tokens[0],
+    # поэтому BM25-компонента для него - нули, как было у BM25Okapi
+    n = len(passages)
     q_tokens = tok(query or "")
-    bm_scores = list(map(float, bm.get_scores(q_tokens)))
-
-    # нормализуем обе шкалы
-    old_scores = [float(p.get("score", 0.0)) for p in passages]
-    old_scores_norm = _minmax(old_scores)
-    bm_norm = _minmax(bm_scores)
-
-    # Смешивание
-    out: List[Dict[str, Any]] = []
-    for p, s_old, s_bm in zip(passages, old_scores_norm, bm_norm):
-        p2 = dict(p)
-        p2["score"] = alpha * s_old + beta * s_bm
-        out.append(p2)
-        
-    out.sort(key=lambda x: x["score"], reverse=True)
-    return out[: max(1, min(top_k, len(out)))]
\ No newline at end of file
+    if q_tokens:
+        bm_scores = np.asarray(bm.get_scores(q_tokens), dtype=np.float32)
+    else:
+        bm_scores = np.zeros(n, np.float32)
+
+    # нормализуем обе шкалы и смешиваем одним векторным выражением
+    old_scores = np.fromiter((float(p.get("score", 0.0)) for p in passages), dtype=np.float32, count=n)
+    final = alpha * _minmax(old_scores) + beta * _minmax(bm_scores)
+
+    # top-k: стабильная сортировка, при равном score сохраняется исходный порядок пассажей.
+    # argpartition не стабилен и при равенстве на k-й позиции отбирает произвольные индексы
+    k = max(1, min(top_k, n))
+    idx = np.argsort(-final, kind="stable")[:k]
+
+    return [{**passages[i], "score": float(final[i])} for i in idx.tolist()]
\ No newline at end of file
@@ -2,18 +2,24 @@
     Обертка над sentence-transformers для получения эмбеддингов
 
     Публичный API:
-        - class Embedder(model_name: str)
-        - .encode(textx: list[str] | str, *, batch_size_32, normalize=True) -> np.nda
+        - class Embedder(model_name: str, *, onnx_file: str | None = None)
+        - .encode(textx: list[str] | str, *, batch_size_32, normalize=True, dtype="float32") -> np.nda
+        - .encode_tensor(texts, *, batch_size=32, normalize=True) -> torch.Tensor
         - .dim - int
         - .model_name -> str
+        - get_embedder(model_name: str, *, onnx_file: str | None = None) -> Embedder
     Особенности:
         -Ленивое создание модели и кэширование между вызовами
         - Автовыбор устройства: CUDA если доступна, иначе CPU
-        - возврщает float32 NumPy-массив, при normalize=True векторы L2-нормированы
+        - На CUDA модель переводится в FP16 (вдвое меньше памяти, Tensor Cores)
+        - На CPU можно подключить квантованную (int8) ONNX-модель: onnx_file - путь к файлу
+          внутри репозитория модели, например "onnx/model_qint8_avx512.onnx"
+        - возврщает float32 NumPy-массив, при normalize=True векторы L2-нормированы;
+          dtype="float16" - сразу в формате хранения индекса
 """
 
 from __future__ import annotations
-from typing import Iterable, List, Union, Dict
+from typing import Iterable, List, Optional, Tuple, Union, Dict
 
 import numpy as np
 
@@ -26,7 +32,7 @@ from sentence_transformers import SentenceTransformer
 
 TextLike = Union[str, Iterable[str]]
 
-_MODEL_CACHE: Dict[str, "Embedder"] = {}
+_MODEL_CACHE: Dict[Tuple[str, Optional[str]], "Embedder"] = {}
 
 def _get_device() -> str:
     if torch is not None:
@@ -38,19 +44,30 @@ def _get_device() -> str:
     return "cpu"
 
 class Embedder:
-    def __init__(self, model_name: str):
+    def __init__(self, model_name: str, *, onnx_file: Optional[str] = None):
         self._model_name = model_name
         self._device = _get_device()
 
         # trust_remote_code=False для безопасности, модель должна быть из st hub
-        self._model = SentenceTransformer(model_name, device=self._device)
+        if self._device == "cpu" and onnx_file:
+
+            # int8-квантованная ONNX-модель: быстрее и компактнее на CPU
+            self._model = SentenceTransformer(
+                model_name, device=self._device, backend="onnx", model_kwargs={"file_name": onnx_file}
+            )
+        else:
+            self._model = SentenceTransformer(model_name, device=self._device)
+
+        # На GPU считаем в половинной точности
+        if self._device == "cuda":
+            self._model = self._model.half()
 
         # Некоторые модели отдают разное число измерений в зависимости от polling
         self._dim = int(self._model.get_sentence_embedding_dimension())
 
     # Свойства
     @property
-    def model_name(sef) -> str:
+    def model_name(self) -> str:
         return self._model_name
 
     @property
@@ -64,36 +81,57 @@ class Embedder:
         *,
         batch_size: int = 32,
         normalize: bool = True,
+        dtype: str = "float32",
     ) -> np.ndarray:
 
         # Возвращает np.ndarray формы
-        if isinstance(texts, str):
-            data: List[str] = [texts]
-        else:
-            data = [str(t) for t in texts]
+        data = self._as_list(texts)
         if not data:
-            return np.zeros((0, self.dim), dtype="float32")
-
-        # sentence-transformers сам бьет на батчи
-        arr = self._model.encode(
+            return np.zeros((0, self.dim), dtype=dtype)
+
+        # Нормировка и приведение типа - на стороне torch (на устройстве модели),
+        # в NumPy переносим уже готовый тензор без лишней копии через astype
+        t = self.encode_tensor(data, batch_size=batch_size, normalize=normalize)
+        t = t.to(getattr(torch, dtype))
+        if not t.is_contiguous():
+            t = t.contiguous()
+        return t.cpu().numpy()
+
+    # Вариант для скоринга через torch.matmul: тензор остается на устройстве модели, без NumPy
+    def encode_tensor(
+        self,
+        texts: TextLike,
+        *,
+        batch_size: int = 32,
+        normalize: bool = True,
+    ) -> "torch.Tensor":
+        if torch is None:
+            raise RuntimeError("encode_tensor требует установленный torch")
+        data = self._as_list(texts)
+        if not data:
+            return torch.zeros((0, self.dim), dtype=torch.float32, device=self._device)
+        return self._model.encode(
             data,
             batch_size=batch_size,
-            convert_to_numpy=True,
+            convert_to_tensor=True,
             normalize_embeddings=normalize,
+            precision="float32",
             show_progress_bar=False,
         )
 
-        # Гарантируем float32
-        if arr.dtype != np.float32:
-            arr = arr.astype("float32", copy=False)
-        return arr
+    @staticmethod
+    def _as_list(texts: TextLike) -> List[str]:
+        if isinstance(texts, str):
+            return [texts]
+        return [str(t) for t in texts]
 
-# Кэшируем один экземпляр модели на имя
-def get_embedder(model_name: str) -> Embedder:
-       emb = _MODEL_CACHE.get(model_name)
+# Кэшируем один экземпляр модели на имя (и ONNX-файл, если задан)
+def get_embedder(model_name: str, *, onnx_file: Optional[str] = None) -> Embedder:
+       key = (model_name, onnx_file)
+       emb = _MODEL_CACHE.get(key)
        if emb is None:
-            emb = Embedder(model_name)
-            _MODEL_CACHE[model_name] = emb
+            emb = Embedder(model_name, onnx_file=onnx_file)
+            _MODEL_CACHE[key] = emb
        return emb
 
 __all__ = ["Embedder", "get_embedder"]
\ No newline at end of file
@@ -2,16 +2,18 @@
     Хранилище индекса на диске (NumPy + JSONL).
 
     Состав:
-        - embeddings.npy      — матрица эмбеддингов (N, D), dtype=float32, L2-нормирована.
+        - embeddings.npy      — матрица эмбеддингов (N, D), dtype=float16, L2-нормирована.
         - meta.jsonl          — метаданные по одному JSON-объекту на строку, индекс соответствует строке в embeddings.npy.
-        - cfg.json            — служебная конфигурация индекса (embed_dim).
+        - cfg.json            — служебная конфигурация индекса (embed_dim, dtype, n_rows).
 
     Публичный API:
         - ensure() -> None                                   # гарантирует наличие директории/файлов
         - get_embed_dim(default: int | None = None) -> int   # возвращает D (если нет cfg — пишет default, либо ошибка)
         - set_embed_dim(dim: int) -> None                    # записывает D в cfg.json (однократно при создании)
-        - load_vecs() -> np.ndarray                          # загружает матрицу эмбеддингов
+        - load_vecs() -> np.ndarray                          # матрица эмбеддингов (memmap в dtype хранения, только чтение)
+        - load_vecs_copy() -> np.ndarray                     # матрица эмбеддингов в памяти (изменяемая копия)
         - save_vecs(arr: np.ndarray) -> None                 # атомарно сохраняет матрицу эмбеддингов
+        - append_vecs(arr: np.ndarray) -> None               # дописывает строки в конец embeddings.npy
         - append_meta(items: list[dict]) -> None             # дописывает объекты в meta.jsonl (по одному на строку)
         - load_meta(limit: int | None = None) -> list[dict]  # загружает метаданные (опционально с лимитом)
         - iter_meta() -> Iterator[dict]                      # ленивый итератор по метаданным
@@ -20,23 +22,41 @@
 
     Примечания:
         - Потокобезопасность: рассчитано на одиночный процесс. Для многопроцессного доступа использовать блокировки.
+        - meta.jsonl сериализуется через orjson, если он установлен, иначе через стандартный json.
+        - Векторы хранятся в float16: для косинусной близости нормированных векторов точности достаточно,
+          а файл и страничный кэш вдвое меньше. Приводить к float32 - на стороне вызывающего,
+          только для блока строк, который сейчас скорится. Старые индексы во float32 читаются как есть.
+        - append_vecs дописывает сырые строки после данных .npy, не переписывая файл; заголовок .npy
+          при этом не обновляется, актуальное число строк хранится в cfg.json (n_rows).
+          Строки за пределами n_rows (например, после сбоя до записи cfg) игнорируются и
+          перезаписываются следующим append_vecs.
 """
 
 from __future__ import annotations
+from contextlib import closing
 from typing import Iterator, List, Tuple, Optional
 
 import json
+import mmap
 import os
 import pathlib
 import tempfile
 import numpy as np
 
+try:
+    import orjson
+except Exception:
+    orjson = None
+
 ROOT = pathlib.Path(__file__).resolve().parents[2]
 INDEX_DIR = ROOT / "index"
 EMB_PATH = INDEX_DIR / "embeddings.npy"
 META_PATH = INDEX_DIR / "meta.jsonl"
 CFG_PATH = INDEX_DIR / "cfg.json"
 
+# Тип хранения эмбеддингов на диске
+VEC_DTYPE = "float16"
+
 # =====================================================================
 # Вспомогательные
 # =====================================================================
@@ -54,6 +74,51 @@ def _atomic_write_bytes(path: pathlib.Path, data: bytes) -> None:
 def _atomic_write_text(path: pathlib.Path, text: str) -> None:
     _atomic_write_bytes(path, text.encode("utf-8"))
 
+# Прочитать cfg.json (битый или пустой файл - пустой словарь)
+def _read_cfg() -> dict:
+    try:
+        return json.loads(CFG_PATH.read_text(encoding="utf-8") or "{}")
+    except Exception:
+        return {}
+
+# Компактная запись без отступов: cfg.json переписывается при каждом обновлении индекса
+def _write_cfg(cfg: dict) -> None:
+    _atomic_write_text(CFG_PATH, json.dumps(cfg, ensure_ascii=False, separators=(",", ":")))
+
+# Одна строка meta.jsonl (UTF-8 с завершающим \n)
+def _dump_meta_line(item: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(item, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS)
+    return (json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8")
+
+# Разбор строки meta.jsonl. Ошибки разбора - ValueError (в т.ч. JSONDecodeError)
+def _load_meta_line(line: bytes) -> dict:
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+# Атомарная запись .npy: np.save сразу во временный файл, без промежуточного буфера в памяти.
+# Всегда в C-порядке: load_vecs отображает данные построчно, а append_vecs дописывает строки в конец
+def _atomic_write_npy(path: pathlib.Path, arr: np.ndarray) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile("wb", delete=False, dir=str(path.parent)) as tmp:
+        np.save(tmp, np.ascontiguousarray(arr), allow_pickle=False)
+        tmp.flush()
+        os.fsync(tmp.fileno())
+        tmp_path = pathlib.Path(tmp.name)
+    tmp_path.replace(path)
+
+
+# Заголовок .npy: (dtype, shape, fortran_order, смещение начала данных)
+def _read_npy_header(path: pathlib.Path) -> Tuple[np.dtype, Tuple[int, ...], bool, int]:
+    with open(path, "rb") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+        return dtype, shape, bool(fortran), f.tell()
+
 
 # =====================================================================
 # Базовые операции
@@ -63,7 +128,7 @@ def _atomic_write_text(path: pathlib.Path, text: str) -> None:
 def ensure() -> None:
     INDEX_DIR.mkdir(parents=True, exist_ok=True)
     if not EMB_PATH.exists():
-        np.save(EMB_PATH, np.zeros((0, 0), dtype="float32"))
+        np.save(EMB_PATH, np.zeros((0, 0), dtype=VEC_DTYPE))
     if not META_PATH.exists():
         META_PATH.write_text("", encoding="utf-8")
     if not CFG_PATH.exists():
@@ -72,11 +137,7 @@ def ensure() -> None:
 # Прочитать размерность эмбеддинга D из cfg.json. Если отсутсвует - инициализировать default
 def get_embed_dim(default: int | None = None) -> int:
     ensure()
-    try:
-        cfg = json.loads(CFG_PATH.read_text(encoding="utf-8") or "{}")
-    except Exception:
-        cfg = {}
-    dim = cfg.get("embed_dim")
+    dim = _read_cfg().get("embed_dim")
     if dim is None:
         if default is None:
             raise RuntimeError("cfg.json отсутствует поле 'embed_dim'. Установите его через set_embed_dim(dim) "
@@ -88,59 +149,109 @@ def get_embed_dim(default: int | None = None) -> int:
 # Установить размерность эмбеддинга D
 def set_embed_dim(dim: int) -> None:
     ensure()
-    try:
-        cfg = json.loads(CFG_PATH.read_text(encoding="utf-8") or "{}")
-    except Exception:
-        cfg = {}
+    cfg = _read_cfg()
     cfg["embed_dim"] = int(dim)
-    _atomic_write_text(CFG_PATH, json.dumps(cfg, ensure_ascii=False, indent=2))
+    _write_cfg(cfg)
 
-# Загрузить матрицу эмбеддингов
+# Загрузить матрицу эмбеддингов. Файл отображается в память (mmap, только чтение):
+# ОС подгружает строки по мере обращения, вся матрица в RAM не читается.
+# dtype - как на диске (float16), приводить к float32 по блокам при скоринге
 def load_vecs() -> np.ndarray:
     ensure()
-    arr = np.load(EMB_PATH, allow_pickle=False)
-    if arr.ndim != 2:
+    dtype, shape, fortran, offset = _read_npy_header(EMB_PATH)
+    if len(shape) != 2:
 
         # Привести к (0, 0) or (N, D)
-        if arr.size == 0:
-            return np.zeros((0, 0), dtype="float32")
+        if 0 in shape:
+            return np.zeros((0, 0), dtype=VEC_DTYPE)
         raise ValueError(f"embeddings.npy имеет некорректную форму")
-    if arr.dtype != np.float32:
-        arr = arr.astype("float32", copy=False)
-    return arr
 
-# Атомарно сохранить матрицу эмбеддингов
+    # Файл в Fortran-порядке (записан до того, как save_vecs стал приводить к C-порядку):
+    # построчный memmap его перепутает, поэтому отображаем через np.load с учетом порядка
+    if fortran:
+        return np.load(EMB_PATH, mmap_mode="r")
+
+    # Число строк - из cfg.json (учитывает append_vecs), но не больше, чем реально есть в файле
+    d = int(shape[1])
+    n = int(_read_cfg().get("n_rows", shape[0]))
+    if d > 0:
+        n = min(n, (EMB_PATH.stat().st_size - offset) // (dtype.itemsize * d))
+    if n <= 0 or d == 0:
+        return np.zeros((0, d), dtype=dtype)
+    return np.memmap(EMB_PATH, dtype=dtype, mode="r", shape=(n, d), offset=offset)
+
+# Загрузить матрицу эмбеддингов целиком в память - для потребителей, которым нужна запись
+def load_vecs_copy() -> np.ndarray:
+    return np.array(load_vecs(), dtype="float32", copy=True)
+
+# Атомарно сохранить матрицу эмбеддингов (во float16)
 def save_vecs(arr: np.ndarray) -> None:
     ensure()
     if arr.ndim != 2:
         raise ValueError("Ожидается 2D-массив (N, D)")
-    if arr.dtype != np.float32:
-        arr = arr.astype("float32", copy=False)
+    arr = arr.astype(VEC_DTYPE, copy=False)
 
     # Инициализировать embed_dim при необходимости
     try:
         current_dim = get_embed_dim(None)
     except RuntimeError:
-        curremt_dim = None
+        current_dim = None
     if current_dim is None:
         set_embed_dim(int(arr.shape[1]))
     else:
         if arr.shape[1] != current_dim and arr.shape[0] > 0:
             raise ValueError(f"Несоответствие размерности эмбеддинга: D={arr.shape[1]} != cfg.embed_dim={current_dim}")
 
-    # np.save в буфер и атомарно записать
-    with tempfile.TemporaryFile() as tmp:
-        np.save(tmp, arr)
-        tmp.seek(0)
-    _atomic_write_bytes(EMB_PATH, data)
+    _atomic_write_npy(EMB_PATH, arr)
+
+    cfg = _read_cfg()
+    cfg["dtype"] = VEC_DTYPE
+    cfg["n_rows"] = int(arr.shape[0])
+    _write_cfg(cfg)
+
+# Дописать строки в конец embeddings.npy без перезаписи всего файла
+def append_vecs(arr: np.ndarray) -> None:
+    ensure()
+    if arr.ndim != 2:
+        raise ValueError("Ожидается 2D-массив (N, D)")
+    if arr.shape[0] == 0:
+        return
+
+    dtype, shape, fortran, offset = _read_npy_header(EMB_PATH)
+    n = int(_read_cfg().get("n_rows", shape[0])) if len(shape) == 2 else 0
+
+    # Пустой индекс - обычная полная запись (заодно задает D и dtype)
+    if n == 0 or len(shape) != 2 or shape[1] == 0:
+        save_vecs(arr)
+        return
+    if arr.shape[1] != shape[1]:
+        raise ValueError(f"Несоответствие размерности эмбеддинга: D={arr.shape[1]} != {shape[1]}")
+
+    # В файл в Fortran-порядке строки дописать нельзя - переписываем целиком, уже в C-порядке
+    if fortran:
+        save_vecs(np.concatenate([load_vecs(), arr.astype(dtype, copy=False)]))
+        return
+
+    # Пишем сразу после n-й строки и обрезаем возможный хвост от прерванной записи
+    data = np.ascontiguousarray(arr, dtype=dtype)
+    with open(EMB_PATH, "r+b") as f:
+        f.seek(offset + n * dtype.itemsize * int(shape[1]))
+        data.tofile(f)
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+
+    cfg = _read_cfg()
+    cfg["n_rows"] = n + int(arr.shape[0])
+    _write_cfg(cfg)
 
 # Добавить ззаписи в meta.jsonl
 def append_meta(items: List[dict]) -> None:
     ensure()
 
-    # Записываем батчом одним строковым буфером
-    buf = "".join(json.dumps(it, ensure_ascii=False) + "\n" for it in items)
-    with open(META_PATH, "a", encoding="utf-8") as f:
+    # Записываем батчом одним байтовым буфером
+    buf = b"".join(_dump_meta_line(it) for it in items)
+    with open(META_PATH, "ab") as f:
         f.write(buf)
 
 
@@ -148,33 +259,50 @@ def append_meta(items: List[dict]) -> None:
 def load_meta(limit: Optional[int] = None) -> List[dict]:
     ensure()
     out: List[dict] = []
-    with open(META_PATH, "r", encoding="utf-8") as f:
-        for i, line in enumerate(f):
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                out.append(json.loads(line))
-            except json.JSONDecodeError:
-                
-                # Пропустим битую строку
-                continue
-            if limit is not None and len(out) >= limit:
-                break
+
+    # С лимитом читаем только первые строки: ленивый проход iter_meta, остаток файла не трогаем
+    if limit is not None:
+        with closing(iter_meta()) as it:
+            for item in it:
+                out.append(item)
+                if len(out) >= limit:
+                    break
+        return out
+
+    # Весь файл - одним вызовом и режем по \n, без построчного чтения через буфер файла
+    for line in META_PATH.read_bytes().split(b"\n"):
+        if not line or line.isspace():
+            continue
+        try:
+            out.append(_load_meta_line(line))
+        except ValueError:
+
+            # Пропустим битую строку
+            continue
     return out
     
 # Ленивый итератор по meta.jsonl
 def iter_meta() -> Iterator[dict]:
     ensure()
-    with open(META_PATH, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                yield json.loads(line)
-            except json.JSONDecodeError:
-                continue
+    with open(META_PATH, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+
+        # Файл отображается в память, строки выделяются по мере итерации
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            n = len(mm)
+            pos = 0
+            while pos < n:
+                nl = mm.find(b"\n", pos)
+                end = n if nl == -1 else nl
+                line = mm[pos:end]
+                pos = end + 1
+                if not line or line.isspace():
+                    continue
+                try:
+                    yield _load_meta_line(line)
+                except ValueError:
+                    continue
 
 # Вернуть (N, D) - число векторов и размерность
 def index_size() -> Tuple[int, int]:
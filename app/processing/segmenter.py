@@ -12,12 +12,15 @@
         - chunk_text(text: str, cfg: SegmentConfig = SegmentConfig()) -> list[str]
         - chunk_text_with_spans(text: str, cfg: SegmentConfig = SegmentConfig()) -> tuple[list[str]]
         - approximate_pages(pages_meta: list[dict], spans: list[tuple[int, int]]) -> list[int]
+
+    Модуль полностью аннотирован типами (mypy --strict) и может быть собран mypyc
+    в C-расширение без изменения API: mypyc app/processing/segmenter.py
 """
 
 from __future__ import annotations
+from bisect import bisect_left, bisect_right
 from dataclasses import dataclass
-from hashlib import pbkdf2_hmac
-from typing import List, Tuple, Iterable, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import re
 
@@ -50,14 +53,21 @@ class SegmentConfig:
     # Минимальная длина предложения
     min_sent_len: int = 20
 
+    # Цель разреза для _soft_cut, приведенная к [min_len, max_len].
+    # Свойство, а не кэш: поля конфигурации можно менять после создания
+    @property
+    def effective_target(self) -> int:
+        if self.target_len < self.min_len:
+            return (self.min_len + self.max_len) // 2
+        return max(self.min_len, min(self.target_len, self.max_len))
+
 
 # =====================================================================
 # Регулярные выражения
 # =====================================================================
 
 # Заголовки
-HEAD_RE = re.compile(
-    r"^\s*(?:"
+_HEAD_BODY = (
     r"(?:ГОСТ|СНиП|СП|ПУЭ|СТО)\s+[\w\-.:/]+"
     r"|Раздел\s+\d+"
     r"|Глава\s+\d+"
@@ -65,42 +75,96 @@ HEAD_RE = re.compile(
     r"|Пункт\s+\d+(?:\.\d+){0,4}"
     r"|П\.\s*\d+(?:\.\d+){0,4}"
     r"|[0-9]+(?:\.[0-9]+){0,2}\s+[А-ЯA-ZЁ].{2,}"
-    r")\s*$",
-    re.IGNORECASE,
 )
+HEAD_RE = re.compile(r"^\s*(?:" + _HEAD_BODY + r")\s*$", re.IGNORECASE)
 
 # Слабые заголовки: строки Верхним регистром средней длины
-UPPER_HEADING_RE = re.compile(r"^[A-ZА-ЯЁ0-9 \-,:()]{8,80}$")
+_UPPER_BODY = r"[A-ZА-ЯЁ0-9 \-,:()]{8,80}"
+UPPER_HEADING_RE = re.compile(r"^" + _UPPER_BODY + r"$")
+
+# Оба вида заголовков для поиска по всему тексту сразу: группа head/upper начинается с первого
+# непробельного символа строки, т.е. совпадает с началом абзаца после strip().
+# [^\S\n] - пробельные символы внутри строки (те же, что снимает strip(), кроме перевода строки).
+# Тело - в опережающей проверке, чтобы совпадение (\s+ может захватить перевод строки)
+# не поглощало следующие строки и каждая строка проверялась независимо.
+# Для upper регистр учитывается, а требование хотя бы одной буквы заменяет s.isupper()
+HEAD_RE_ML = re.compile(
+    r"^[^\S\n]*(?:"
+    r"(?=(?P<head>" + _HEAD_BODY + r")[^\S\n]*$)"
+    r"|(?=(?P<upper>(?-i:(?=[^A-ZА-ЯЁ\n]*[A-ZА-ЯЁ])" + _UPPER_BODY + r"))[^\S\n]*$)"
+    r")",
+    re.IGNORECASE | re.MULTILINE,
+)
 
-# Разделители абзацев: два и более переводов строки
-PARA_SPLIT_RE = re.compile(r"\n{2,}")
+# Связанный метод: без поиска атрибута на каждом вызове в цикле по абзацам
+_HEAD_MATCH = HEAD_RE.match
+_UPPER_HEADING_MATCH = UPPER_HEADING_RE.match
 
-# Разделители предложений для мягкого разреза
-SENT_SPLIT_RE = re.compile(r"(?<=[\.\?\!\:;…])\s+")
+# Концы предложений для мягкого разреза: знак препинания перед пробельным символом или концом текста
+SENT_END_RE = re.compile(r"[.?!:;…](?=\s|\Z)")
 
 
 # =====================================================================
 # Низкоуровневые утилиты
 # =====================================================================
 
-# Разбивает по пустым строкам, убирая лишние пробелы по краям
-def _split_paragraphs(text: str) -> List[str]:
-    parts = [p.strip() for p in PARA_SPLIT_RE.split(text)]
-    return [p for p in parts if p]
+# Разбивает по пустым строкам, убирая лишние пробелы по краям.
+# Возвращает (абзац, start, end) - смещения абзаца (после strip) в исходном тексте,
+# вычисленные за один проход. Лишние \n при 3+ переводах строки снимает strip()
+def _split_paragraphs(text: str) -> List[Tuple[str, int, int]]:
+    out: List[Tuple[str, int, int]] = []
+    append = out.append
+    find = text.find
+    n = len(text)
+    pos = 0
+    while pos < n:
+        nxt = find("\n\n", pos)
+        end = n if nxt == -1 else nxt
+        seg = text[pos:end]
+        p = seg.strip()
+        if p:
+
+            # Перед p в seg только пробельные символы, поэтому первое вхождение p[0] - начало абзаца
+            start = pos + seg.find(p[0])
+            append((p, start, start + len(p)))
+        pos = end + 2
+    return out
+
+# Слабый заголовок: сначала дешевые проверки длины и регистра (isupper - в C, без копии строки)
+def _is_upper_heading(s: str) -> bool:
+    return 8 <= len(s) <= 80 and s.isupper() and _UPPER_HEADING_MATCH(s) is not None
 
 # Эвристика: строка выглядит как заголовок
 def _is_heading(line: str) -> bool:
     s = line.strip()
-    if HEAD_RE.match(s):
-        return True
-    if 8 <= len(s) <= 80 and s == s.upper() and UPPER_HEADING_RE.match(s):
-        return True
-    return False
+    return _HEAD_MATCH(s) is not None or _is_upper_heading(s)
+
+# Флаги "абзац - заголовок" для всех абзацев: HEAD_RE_ML одним проходом по тексту.
+# Абзац - заголовок, если найденный заголовок начинается в его начале и заканчивается
+# на его конце. Если совпадение вышло за конец абзаца (хвостовые пробелы или строка
+# следующего абзаца), абзац перепроверяется целиком через _is_heading
+def _heading_flags(text: str, paragraphs: List[Tuple[str, int, int]]) -> List[bool]:
+    head_ends: Dict[int, int] = {}
+    for m in HEAD_RE_ML.finditer(text):
+        g = m.lastgroup
+        if g is not None:
+            head_ends[m.start(g)] = m.end(g)
+    get = head_ends.get
+    flags: List[bool] = []
+    append = flags.append
+    for p, s, e in paragraphs:
+        h = get(s, -1)
+        if h == e:
+            append(True)
+        elif h == -1:
+            append(False)
+        else:
+            append(_is_heading(p))
+    return flags
 
-# Грубое разбиение абзаца на предложения
-def _split_sentences(par: str) -> List[str]:
-    parts = [p.strip() for p in SENT_SPLIT_RE.split(par)]
-    return [p for p in parts if p]
+# Длина "\n\n".join(parts) без построения строки
+def _joined_len(parts: List[str]) -> int:
+    return sum(map(len, parts)) + 2 * max(0, len(parts) - 1)
 
 """
     Найти позицию мягкого разреза в buffer ближе к target_len
@@ -110,46 +174,30 @@ def _split_sentences(par: str) -> List[str]:
     Возвращает индекс разреза или -1, если не найдено подходящего места
 """
 def _soft_cut(buffer: str, cfg: SegmentConfig) -> int:
+    min_len, max_len = cfg.min_len, cfg.max_len
     n = len(buffer)
-    if n <= cfg.max_len:
+    if n <= max_len:
         return -1
 
     # Желаемая цель
-    target = cfg.target_len
-    if target < cfg.min_len:
-        target = (cfg.min_len + cfg.max_len) // 2
-    target = max(cfg.min_len, min(target, cfg.max_len))
-
-    # По предложениям
-    sents = _split_sentences(buffer)
-    pos = 0
-    best = -1
-    best_dist = 10**9
-    for s in sents:
-        end = pos + len(s)
-        if end < cfg.min_len:
-            continue
-        dist = abs(ens - target)
-        if dist < best_dist and end <= cfg.max_len:
-            best, best_dist = end, dist
+    target = cfg.effective_target
 
+    # По концам предложений: позиции сразу после знака препинания, без нарезки buffer на строки.
+    # Поиск ограничен окном [min_len, max_len] (+1 символ справа для проверки пробела)
+    ends = (m.end() for m in SENT_END_RE.finditer(buffer, max(0, min_len - 1), min(n, max_len + 1)))
+    best = min((e for e in ends if e <= max_len), key=lambda e: abs(e - target), default=-1)
     if best != -1:
         return best
 
-    # По ближайшему пробелу к target внутри [min_len, max_len]
-    left = buffer.rfind(" ", cfg.min_len, min(n, cfg.max_len))
-    right = buffer.find(" ", min(target, n-1), min(n, cfg.max_len))
+    # По ближайшему пробелу к target внутри [min_len, max_len): поиск расходится от target
+    # в обе стороны и останавливается на первом пробеле - просматриваются только символы
+    # между двумя ближайшими к target пробелами
+    hi = min(n, max_len)
+    left = buffer.rfind(" ", min_len, min(target + 1, hi))
+    right = buffer.find(" ", target, hi)
 
-    # Выберем ближайший к target
-    cand = []
-    if left != -1:
-        cand.append((abs(left - target), left))
-    if rigth != -1:
-        cand.append((abs(right - target), right))
-    if cand:
-        cand.sort()
-        return cand[0][1]
-    return -1
+    # Выберем ближайший к target (при равенстве - левый)
+    return min((c for c in (left, right) if c != -1), key=lambda c: abs(c - target), default=-1)
 
 
 # ========================================================================
@@ -168,151 +216,159 @@ def chunk_text(text: str, cfg: SegmentConfig = SegmentConfig()) -> List[str]:
 def chunk_text_with_spans(text: str, cfg: SegmentConfig = SegmentConfig()) -> Tuple[List[str], List[Tuple[int, int]]]:
     paragraphs = _split_paragraphs(text)
 
-    # Подготовим пары (par_text, is_heading)
-    items: List[Tuple[str, bool]] = []
-    for par in paragraphs:
-        is_head = _is_heading(p)
-        items.append((p, is_head))
+    # Подготовим (par_text, start, end, is_heading)
+    flags = _heading_flags(text, paragraphs)
+    items: List[Tuple[str, int, int, bool]] = [(p, s, e, h) for (p, s, e), h in zip(paragraphs, flags)]
+
+    min_len, max_len, overlap = cfg.min_len, cfg.max_len, cfg.overlap
+    prefer_headings = cfg.prefer_headings
 
     chunks: List[str] = []
     spans: List[Tuple[int, int]] = []
 
-    buf = ""
+    # Буфер текущего чанка - список абзацев; склеиваем через "\n\n" только при выдаче чанка.
+    # Все части буфера уже без пробелов по краям (абзацы - после strip() в _split_paragraphs,
+    # overlap и остаток после разреза - strip() при создании), поэтому склеенный буфер strip() не нужен,
+    # а кусок до мягкого разреза начинается с непробельного символа - хватает rstrip()
+    buf_parts: List[str] = []
+    buf_len = 0   # длина "\n\n".join(buf_parts) без построения строки
     buf_start = 0 # смещение начала буфера в исходном тексте
-    cursor = 0 # текущая позиции сканирования в исходном тексте
-
-    """
-        Чтобы корректно вычислить cursor, пройдем текст и будем искать каждый абзац
-        Будем считать, что между абзацами - минимум два \n
-        Для поиска смещений используем .find с начальной позицей
-    """
-    for p, is_head in items:
-
-        # Найти реальное начало этого абзаца в исходном тексте начиная с cursor
-        idx = text.find(p, cursor)
-        if idx == -1:
+    buf_end = 0   # смещение конца последнего абзаца буфера в исходном тексте
 
-            # На всякий случай: если не нашли, продолжаем от текущего cursor
-            idx = cursor
+    # Смещения абзацев уже известны из _split_paragraphs - повторный поиск по тексту не нужен
+    for p, idx, p_end, is_head in items:
 
         """
             Если текущий абзац - "Жесткий" заголовок и в буфере уже есть существующий чанк,
             то предпочитаем закрыть текущий чанк на предыдущем шаге
         """
-        if is_head and buf and len(buf) >= cfg.min_len and cfg.prefet_headings:
+        if is_head and buf_parts and buf_len >= min_len and prefer_headings:
+            buf = "\n\n".join(buf_parts)
 
             # Мягкий разрез при необходимости
             cut_at = _soft_cut(buf, cfg)
             if cut_at != -1:
-                chunk = buf[:cut_at].strip()
+                chunk = buf[:cut_at].rstrip()
                 chunks.append(chunk)
                 spans.append((buf_start, buf_start + cut_at))
 
                 # Подготовим новый буфер с overlap
-                overlap_text = buf[max(0, cut_at - cfg.overlap):cut_at].strip()
-                buf = (overlap_text + "\n" + buf[cut_at:]).strip()
+                overlap_text = buf[max(0, cut_at - overlap):cut_at].strip()
+                buf_parts = [s for s in (overlap_text, buf[cut_at:].strip()) if s]
+                buf_len = _joined_len(buf_parts)
                 buf_start = buf_start + cut_at - len(overlap_text)
             else:
 
                 # Закрываем по буферу целиком
-                chunks.append(buf.strip())
-                spans.append((buf_start, buf_start + len(buf)))
+                chunks.append(buf)
+                spans.append((buf_start, buf_end))
 
                 # Новый буфер - пуст
-                buf = ""
-                buf_start = idx # Начало нового буфера свмещаем сначало абзаца
+                buf_parts = []
+                buf_len = 0
 
         # Если буфер пуст - стартуем новый чанк с этого абзаца
-        if not buf:
-            buf = p
+        if not buf_parts:
+            buf_parts = [p]
+            buf_len = len(p)
             buf_start = idx
-        else:
-
-            # иначе пытаемся добавить абзац
-            candidate = (buf + "\n\n" +p).strip()
-            if len(candidate) <= cfg.max_len:
-                buf = candidate
-            else:
-
-                # Переполнится - пробуйем мягко разрезать текущий buf
-                cut_at = _soft_cut(buf, cfg)
-                if cut_at == -1:
-
-                    # Если мягкого места нет - режем по текущему buf как есть
-                    chunks.append(buf.strip())
-                    spans.append((buf_start, buf_start + len(buf)))
-
-                    # Новый буфер начинается в overlap хвоста
-                    overlap_text = buf[max(0, len(buf) - cfg.overlap):].strip()
-                    buf = (overlap_text + "\n\n" +p).strip()
-                    chunks.append(chunk)
-                    spans.append((buf_start, buf_start + len(buf)))
-
-                    # Новый буфер формируем с перекрытием и добавляем текущий ажбзац
-                    overlap_text = buf[max(0, cut_at - cfg.overlap): cut_at].strip()
-                    buf = (overlap_text + "\n\n" + buf[cut_at:].strip() + "\n\n" + p).strip
-                    buf_start = buf_start + cut_at - len(overlap_text)
-
-            # Обновляем курсор на конце найденного абзаца + двойной перенос
-            cursor = idx + len(p)
-
-        # Стиль остатки
-        if buf:
+            buf_end = p_end
+            continue
 
-            # Если короткий хвост - слить с предыдущим чанком при возможности
-            if len(buf) < cfg.min_len and chunks:
-                prev = chunks[-1]
-                merged = (prev + "\n\n" + buf).strip()
-                if len(merged) <= cfg.max_len:
-                    chunks[-1] = merged
+        # иначе пытаемся добавить абзац
+        if buf_len + 2 + len(p) <= max_len:
+            buf_parts.append(p)
+            buf_len += 2 + len(p)
+            buf_end = p_end
+            continue
 
-                    # Обновим span предыдущего: расширм до конца текущего буфера
-                    prev_start, _prev_end = spans[-1]
-                    spans[-1] = (prev_start, prev_start + len(merged))
-                else:
+        # Переполнится - пробуем мягко разрезать текущий буфер
+        buf = "\n\n".join(buf_parts)
+        cut_at = _soft_cut(buf, cfg)
+        if cut_at == -1:
 
-                    # Иначе добавим как отдельный небольшой чанк
-                    chunks.append(buf.strip())
-                    spans.append((len(text) - len(buf), len(text)))
+            # Если мягкого места нет - режем по текущему буферу как есть
+            chunks.append(buf)
+            spans.append((buf_start, buf_end))
 
-            else:
-                chunks.append(buf.strip())
-                spans.append((len(text) - len(buf), len(text)))
+            # Новый буфер начинается с overlap хвоста и текущего абзаца
+            overlap_text = buf[max(0, buf_len - overlap):].strip()
+            buf_parts = [s for s in (overlap_text, p) if s]
+            buf_start = buf_end - len(overlap_text) if overlap_text else idx
+        else:
+            chunk = buf[:cut_at].rstrip()
+            chunks.append(chunk)
+            spans.append((buf_start, buf_start + cut_at))
+
+            # Новый буфер формируем с перекрытием, остатком после разреза и текущим абзацем
+            overlap_text = buf[max(0, cut_at - overlap):cut_at].strip()
+            buf_parts = [s for s in (overlap_text, buf[cut_at:].strip(), p) if s]
+            buf_start = buf_start + cut_at - len(overlap_text)
+        buf_len = _joined_len(buf_parts)
+        buf_end = p_end
+
+    # Остаток буфера
+    if buf_parts:
+        buf = "\n\n".join(buf_parts)
+
+        # Если короткий хвост - слить с предыдущим чанком при возможности
+        if buf_len < min_len and chunks and len(chunks[-1]) + 2 + buf_len <= max_len:
+            chunks[-1] = chunks[-1] + "\n\n" + buf
+
+            # Обновим span предыдущего: расширим до конца текущего буфера
+            prev_start, _prev_end = spans[-1]
+            spans[-1] = (prev_start, buf_end)
+        else:
+            chunks.append(buf)
+            spans.append((buf_start, buf_end))
 
-        return chunks, spans
+    # Инвариант: чанки без пробелов по краям (проверяется, если Python запущен без -O)
+    assert all(c == c.strip() for c in chunks)
+    return chunks, spans
 
 # =======================================================================
 # Привязка к страницам
 # =======================================================================
 
 # Преобразует список (start, end) чанков к (page_from, page_to) по статистике
+# Страницы в pages_meta идут по порядку, поэтому границы монотонны и диапазон страниц
+# для каждого чанка ищется бинарным поиском
 
 def approximate_pages(
-    pages_meta: List[dict],
+    pages_meta: List[Dict[str, Any]],
     spans: List[Tuple[int, int]],
 ) -> List[Tuple[Optional[int], Optional[int]]]:
 
     if not pages_meta:
         return [(None, None) for _ in spans]
 
-    # Преврати статистику в кумулятивные границы символов для каждой страницы
-    cutoffs: List[Tuple[nt, int, int]] = []
+    # Границы символов для каждой страницы: смещения start/end из загрузчика PDF,
+    # если они есть, иначе - кумулятивная сумма chars
+    page_starts: List[int] = []
+    page_ends: List[int] = []
+    page_ids: List[int] = []
     s = 0
     for p in pages_meta:
-        s2 = s + int(p.get("chars", 0))
-        cutoffs.append((s, s2, int(p.get("page", 0)) or (len(cutoffs) + 1)))
-        s = s2
-
-    page_ranges: List[Tupe[Optional[int], Optional[int]]] = []
+        a, b = p.get("start"), p.get("end")
+        if a is None or b is None:
+            a, b = s, s + int(p.get("chars", 0))
+        page_starts.append(int(a))
+        page_ends.append(int(b))
+        page_ids.append(int(p.get("page", 0)) or (len(page_ids) + 1))
+        s = int(b)
+
+    # Страница задета чанком, если end страницы > start и start страницы < end:
+    # первая такая - bisect_right по концам, последняя - bisect_left по началам минус один
+    page_ranges: List[Tuple[Optional[int], Optional[int]]] = []
     for (start, end) in spans:
-        pages_hit = [pg for (a, b, pg) in cutoffs if not (b <= start or a >= end)]
-        if pages_hit:
-            page_ranges.append((min(pages_hit), max(pages_hit)))
+        lo = bisect_right(page_ends, start)
+        hi = bisect_left(page_starts, end) - 1
+        if lo <= hi:
+            page_ranges.append((page_ids[lo], page_ids[hi]))
         else:
             page_ranges.append((None, None))
     return page_ranges
 
-
 __all__ = [
     "SegmentConfig",
     "chunk_text",
@@ -3,17 +3,18 @@
 
     Функции:
         - find_anchors(text) -> List[Anchor] извлекает якори заголовоков
-        - annotate_chunks_with_sections(text, chunks) -> List[str]: для каждого чанка возвращает метку ближашего
+        - annotate_chunks_with_sections(text, chunks, spans) -> List[str]: для каждого чанка возвращает метку ближашего
         - build_outline(text) -> List[Anchor]: плоский список якорей с уровнями
     
     Зависимости: только стандартная библиотека
 """
 
 from __future__ import annotations
+from bisect import bisect_right
 from dataclasses import dataclass
-from multiprocessing import current_process
 from typing import List, Optional, Tuple
 import re
+import sys
 
 from app.cli import ingest
 
@@ -21,47 +22,54 @@ from app.cli import ingest
 # Регулярные выражения
 # =====================================================================
 
+# Все виды якорей собраны в одно регулярное выражение: текст просматривается за один проход,
+# вид якоря определяется по имени сработавшей внешней группы (m.lastgroup).
+# Имена групп в Python должны быть уникальны, поэтому у внутренних групп префикс вида.
+# Пробелы - только [^\S\n] (пробельные символы, кроме перевода строки - в т.ч. \xa0 и \x0c из PDF):
+# якорь не выходит за свою строку и не поглощает следующую
+
 # Разделы верхнего уровня
-RE_SECTION = re.compile(
-    r"^\s*(?P<kind>Раздел|Глава|Часть)\s+(?P<id>(?:[IVXLCDM]+|\d+))\s*[.)]?\s*(?P<title>.*)$",
-    re.IGNORECASE | re.MULTILINE,
-)
+_SECTION = r"(?P<section>^[^\S\n]*(?P<sec_kind>Раздел|Глава|Часть)[^\S\n]+(?P<sec_id>(?:[IVXLCDM]+|\d+))[^\S\n]*[.)]?[^\S\n]*(?P<sec_title>.*)$)"
 
 # Приложения (часто буквенные индексы)
-RE_APPENDIX = re.compile(
-    r"^\s*(?P<kind>Приложение)\s*(?P<id>[A-ЯA-Z\d]+)?\s*[.)]?\s*(?P<title>.*)$",
-    re.IGNORECASE | re.MULTILINE,
-)
+_APPENDIX = r"(?P<appendix>^[^\S\n]*(?P<app_kind>Приложение)[^\S\n]*(?P<app_id>[A-ЯA-Z\d]+)?[^\S\n]*[.)]?[^\S\n]*(?P<app_title>.*)$)"
 
 # Пункты/Подпункты (в т.ч. краткая форма)
-RE_CLAUSE = re.compile(
-    r"^\s*(?P<kind>Пункт|Подпункт|П\.|п\.)\s+(?P<id>\d+(?:\.\d+){0,4})\s*[.)]?\s*(?P<title>.*)$",
-    re.IGNORECASE | re.MULTILINE,
-)
+_CLAUSE = r"(?P<clause>^[^\S\n]*(?P<cl_kind>Пункт|Подпункт|П\.|п\.)[^\S\n]+(?P<cl_id>\d+(?:\.\d+){0,4})[^\S\n]*[.)]?[^\S\n]*(?P<cl_title>.*)$)"
 
-# Нумерованные заголовки без ключевого слова
-RE_NUM_TITLE = re.compile(
-    r"^\s*(?P<id>\d+(?:\.\d+){0,2})\s+(?P<title>[A-ЯA-ZЁ].{2,})$",
-    re.MULTILINE,
-)
+# Нумерованные заголовки без ключевого слова (регистр учитывается: заголовок с заглавной буквы)
+_NUM_TITLE = r"(?P<numtitle>(?-i:^[^\S\n]*(?P<num_id>\d+(?:\.\d+){0,2})[^\S\n]+(?P<num_title>[A-ЯA-ZЁ].{2,})$))"
 
 # Таблицы/рисунки - полезно для навигации, но обычно Не верний уровень секционирования
-RE_TABLE = re.compile(
-    r"^\s*(?P<kind>Таблица)\s+(?P<id>\d+(?:\.\d+)*)\s*(?P<title>.*)$",
-    re.IGNORECASE | re.MULTILINE, 
-)
+_TABLE = r"(?P<table>^[^\S\n]*(?P<tab_kind>Таблица)[^\S\n]+(?P<tab_id>\d+(?:\.\d+)*)[^\S\n]*(?P<tab_title>.*)$)"
+
+_FIG = r"(?P<figure>^[^\S\n]*(?P<fig_kind>Рисунок)[^\S\n]+(?P<fig_id>\d+(?:\.\d+)*)[^\S\n]*(?P<fig_title>.*)$)"
 
-RE_FIG = re.compile(
-    r"^\s*(?P<kind>Рисунок)\s+(?P<id>\d+(?:\.\d+)*)\s*(?P<title>.*)$",
+RE_ANCHOR = re.compile(
+    "|".join((_SECTION, _APPENDIX, _CLAUSE, _NUM_TITLE, _TABLE, _FIG)),
     re.IGNORECASE | re.MULTILINE,
 )
 
+# Вид якоря -> имена групп (исходное слово, идентификатор, заголовок)
+_ANCHOR_GROUPS = {
+    "section": ("sec_kind", "sec_id", "sec_title"),
+    "appendix": ("app_kind", "app_id", "app_title"),
+    "clause": ("cl_kind", "cl_id", "cl_title"),
+    "numtitle": (None, "num_id", "num_title"),
+    "table": ("tab_kind", "tab_id", "tab_title"),
+    "figure": ("fig_kind", "fig_id", "fig_title"),
+}
+
+# Приоритет вида якоря при дедупликации: меньше - более "специализированный"
+_KIND_PRIORITY = {"section": 1, "appendix": 1, "clause": 2, "numtitle": 3, "table": 9, "figure": 9}
+
 
 # =======================================================================
 # Структуры данных
 # =======================================================================
 
-@dataclass
+# slots: без __dict__ у каждого экземпляра - якорей в документе тысячи
+@dataclass(slots=True)
 class Anchor:
     kind: str                           # 'section' | 'appendix' | 'clause' | 'table' | 'figure'
     id: str                             # индетификатор (номер/буква/римская цифра)
@@ -71,25 +79,25 @@ class Anchor:
     level: int                          # иерархический уровень
     raw_kind: Optional[str] = None      # исходное слово из текста (раздел/глава/пунк)
 
-# Человекочитаемая метка
-def label(self) -> str:
-    if self.kind == "section":
-        base = f"{self.raw_kind or 'Раздел'} {self.id}"
-    elif self.kind == "appendix":
-        base = f"Приложение {self.id or ''}".strip()
-    elif self.kind == "clause":
-        base = f"Пункт {self.id}"
-    elif self.kind == "numtitle":
-        base = f"{self.id}"
-    elif self.kind == "table":
-        base = f"Таблица {self.id}"
-    elif self.kind == "figure":
-        base = f"Рисунок {self.id}"
-    else:
-        base = self.id
-    if self.title:
-        return f"{base}: {self.title}".strip()
-    return base
+    # Человекочитаемая метка
+    def label(self) -> str:
+        if self.kind == "section":
+            base = f"{self.raw_kind or 'Раздел'} {self.id}"
+        elif self.kind == "appendix":
+            base = f"Приложение {self.id or ''}".strip()
+        elif self.kind == "clause":
+            base = f"Пункт {self.id}"
+        elif self.kind == "numtitle":
+            base = f"{self.id}"
+        elif self.kind == "table":
+            base = f"Таблица {self.id}"
+        elif self.kind == "figure":
+            base = f"Рисунок {self.id}"
+        else:
+            base = self.id
+        if self.title:
+            return f"{base}: {self.title}".strip()
+        return base
 
 
 # ========================================================================
@@ -97,17 +105,20 @@ def label(self) -> str:
 # ========================================================================
 
 # Грубая оценка уровня по количеству точек в идентификаторе
-def _bot_depth(num_id: str) -> int:
+def _dot_depth(num_id: str) -> int:
     return num_id.count(".") + 1 if num_id else 1
 
-def _mk_anchor(kind: str, raw_kind: str, _id: str, title: str, start: int) -> Anchor:
-    k = kind
+# kind и raw_kind - из небольшого словаря: интернируем, чтобы якоря делили одни и те же строки,
+# а сравнения вида k in ("table", "figure") срабатывали по идентичности
+def _mk_anchor(kind: str, raw_kind: Optional[str], _id: str, title: str, start: int) -> Anchor:
+    k = sys.intern(kind)
+    raw_kind = sys.intern(raw_kind) if raw_kind else None
 
     # Уровни: section\appendix = 1; clause\numtitle - по глубине; table\figure - 99
     if k in ("section", "appendix"):
         level = 1
     elif k in ("clause", "numtitle"):
-        level = min(1 + _dot_depth(id), 6)
+        level = min(1 + _dot_depth(_id), 6)
     elif k in ("table", "figure"):
         level = 99
     else:
@@ -120,52 +131,46 @@ def _mk_anchor(kind: str, raw_kind: str, _id: str, title: str, start: int) -> An
 # ========================================================================
 
 # Находит заголовки и возвращает список Anchor, отсортированные по позиции
-# Поля end вычисляются как начало следующего анкера
+# Поля end вычисляются как начало следующего анкера (после удаления дубликатов)
 
 def find_anchors(text: str) -> List[Anchor]:
-    anchors: List [Anchor] = []
-
-    for m in RE_SECTION.finditer(text):
-        anchors.append(_mk_anchor("section", m.group("kind"), m.group("id"), m.group("title"), m.start()))
-
-    for m in RE_APPENDIX.finditer(text):
-        anchors.append(_mk_anchor("appendix", m.group("kind"), m.group("id") or "", m.group("title"), m.start()))
-
-    for m in RE_CLAUSE.finditer(text):
-        anchors.append(_mk_anchor("clause", m.group("kind"), m.group("id"), m.group("title"),m.start()))
-
-    for m in RE_NUM_TITLE.finditer(text):
-        anchors.append(_mk_anchor("numtitle", m.group("kind"), m.group("id"),m.group("title"), m.start()))
-
-    for m in RE_TABLE.finditer(text):
-        anchors.append(_mk_anchor("table", m.group("kind"), m.group("id"), m.group("title"), m.start()))
-
-    for m in RE_FIG.finditer(text):
-        anchors.append(_mk_anchor("figure", m.group("kind"), m.group("id"), m.group("title"), m.start()))
-
-    # Упорядочим по позиции и проставим end
-    anchors.sort(key=lambda a: a.start)
-    n = len(anchors)
-    for i, a in enumerate(anchors):
-        a.end = anchors[i + 1].start if i + 1 < n else len(text)
+    anchors, _starts = _find_anchors(text)
+    return anchors
+
+# То же, что find_anchors, плюс отдельный список начал якорей [a.start for a in anchors]:
+# его собирает тот же проход, что и end, а поиск по позиции (bisect) идет только по нему
+def _find_anchors(text: str) -> Tuple[List[Anchor], List[int]]:
+    anchors: List[Anchor] = []
+    add = anchors.append
+    groups = _ANCHOR_GROUPS
+
+    # Один проход finditer выдает совпадения по возрастанию позиции - сортировка не нужна
+    for m in RE_ANCHOR.finditer(text):
+        kind = m.lastgroup
+        g_kind, g_id, g_title = groups[kind]
+        raw_kind = m.group(g_kind) if g_kind else None
+        add(_mk_anchor(kind, raw_kind, m.group(g_id) or "", m.group(g_title), m.start()))
 
     # Удаляем дубликаты, когда RE_NUM_TITLE пересекается с RE_CLAUSE
     dedup: List[Anchor] = []
+    priority = _KIND_PRIORITY.get
     for a in anchors:
         if dedup and abs(a.start - dedup[-1].start) < 2 and a.id == dedup[-1].id:
 
             # Предпочитаем более "специализированный" тип
-            priority = {"section": 1, "appendix": 1, "clause": 2, "numtitle": 3, "table": 9, "figure": 9}
-            if priority.get(a.kind, 5) < priority.get(dedup[-1].kind, 5):
+            if priority(a.kind, 5) < priority(dedup[-1].kind, 5):
                 dedup[-1] = a
             continue
         dedup.append(a)
 
-    # Повторно выставим end после дедупликации
-    for i, a in enumerate(dedup):
-        a.end = dedup[i + 1].start if i + 1 < len(dedup) else len(text)
+    # Проставим end (только после дедупликации - она меняет соседей)
+    starts = [a.start for a in dedup]
+    ends = starts[1:]
+    ends.append(len(text))
+    for a, end in zip(dedup, ends):
+        a.end = end
 
-    return dedup
+    return dedup, starts
 
 # ========================================================================
 # Аннотация чанков
@@ -173,54 +178,26 @@ def find_anchors(text: str) -> List[Anchor]:
 
 """
     Возвращает наиболее релевантный якорь для позиции pos:
-     -  берем последний якорь, у которого start <= pos;
-     -  предпочитаем более низкий уровень (clause/numtitle) над section/appendix
+     -  берем последний якорь, у которого start <= pos (бинарный поиск по starts);
+     -  "более конкретный" якорь рядом не ищем: каждый якорь занимает свою строку и после
+        дедупликации в find_anchors два якоря не делят одну позицию, а более ранний якорь
+        относится к предыдущему фрагменту текста (например, пункт прошлого раздела)
+    starts - отсортированные начала якорей: [a.start for a in anchors]
 """
 
-def _best_anchor_for_pos(anchors: List[Anchor], pos: int) -> Optional[Anchor]:
-    if not anchors:
-        return None
-
-    candidate: Optional[Anchor] = None
-    for a in anchors:
-        if a.start <= pos:
-            candidate = a
-        else:
-            break
-    
-    if candidate is None:
-        return None
-
-    # Пробуем найти ближайший "более конкретный" якрорь в окрестности
-    # Окно: от ближайшего section до текущей позиии
-    best = candidate
-    for a in reversed(anchors):
-        if a.start > pos:
-            continue
-
-        # Пропустим слишком общие объекты
-        if a.kind in ("table", "figure"):
-            continue
-
-        # Выбираем ближайший по позиции и с наибольшей детализацией
-        if a.start <= pos and a.start >= best.start:
-
-            # Если новый якорь более детальный
-            if (a.level > bext.level and a.level < 99) or (a.level == best.level and a.start >= best.start):
-                best = a
-    return best
+def _best_anchor_for_pos(anchors: List[Anchor], starts: List[int], pos: int) -> Optional[Anchor]:
+    i = bisect_right(starts, pos) - 1
+    return anchors[i] if i >= 0 else None
 
 # Для каждого чанка возвращает строковую метку
+# Позиция чанка берется из spans (как их возвращает chunk_text_with_spans)
 # Если ничего подходящего не найден - None
-def annotate_chunks_with_sections(text: str, chunks: List[str]) -> List[str]:
-    anchors = find_anchors(text)
-    labels: List[str] = []
-    cursor = 0
-    for ch in chunks:
-        start = current_process
-        anchor = _best_anchor_for_pos(anchors, start)
-        labels.append(anchor.lebel() if anchor else None)
-        cursor += len(ch) + 1
+def annotate_chunks_with_sections(text: str, chunks: List[str], spans: List[Tuple[int, int]]) -> List[Optional[str]]:
+    anchors, starts = _find_anchors(text)
+    labels: List[Optional[str]] = []
+    for start, _end in spans:
+        anchor = _best_anchor_for_pos(anchors, starts, start)
+        labels.append(anchor.label() if anchor else None)
     return labels
 
 